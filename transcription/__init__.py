@@ -1,8 +1,16 @@
+import os
+# lets the caching allocator grow segments in place instead of fragmenting across whisper, alignment and diarization
+# has to be set before cuda is initialised
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 from numpy import ndarray
-from pandas import DataFrame
+from pyannote.core import Annotation
 from module.dataclasses import TranscriptionError, TranscriptionResult, AlignmentResult
-from module.pipeline import load_audio, transcribe_audio, align_transcript_segments, run_diarization_pipeline, postprocess_segments
-from typing import Callable
+from module.pipeline import load_audio, transcribe_audio, align_transcript_segments, run_diarization_pipeline, postprocess_segments, \
+    empty_device_cache, DEFAULT_BATCH_SIZE, LOW_VRAM
+from module.models import COMPUTE_TYPES, set_compute_type, get_align_model, get_diarization_pipeline, get_whisper_model, \
+    release_align_model, release_whisper_model
+from typing import Callable, Final
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from enum import Enum
 
 class CurrentState(str, Enum):
@@ -13,21 +21,74 @@ class CurrentState(str, Enum):
     DIARIZING = "diarizing"
     POSTPROCESSING = "postprocessing"
 
-def generate_diarized_transcript(audio_bytes: bytes, on_status: Callable[[str], None] | None = None) -> bytes:
-    """runs transcription, alignment, diarization, and formatting for a single audio blob"""
+# long-lived workers for the audio decode and for diarization, which only needs the waveform,
+# so both overlap with what the calling thread does on the gpu
+_BACKGROUND_EXECUTOR: Final[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=2, thread_name_prefix="transcription")
+
+def load_models(low_vram: bool = LOW_VRAM) -> None:
+    """loads and caches the whisper, alignment and diarization models up front; with low_vram the aligner waits for whisper to be released"""
+    _load_stage_models(low_vram)
+    get_diarization_pipeline()
+
+def generate_diarized_transcript(audio_bytes: bytes, on_status: Callable[[str], None] | None = None,
+                                 batch_size: int = DEFAULT_BATCH_SIZE, low_vram: bool = LOW_VRAM) -> bytes:
+    """
+    runs transcription, alignment, diarization, and formatting for a single audio blob
+    with low_vram the stages run one after another: whisper and the aligner are unloaded once they are done,
+    cached cuda blocks are released between stages, and diarization only runs after both are gone, so one model works on the gpu at a time.
+    the pyannote pipeline stays cached between calls; the next call loads the other two again
+    """
+    try:
+        if on_status: on_status(CurrentState.RECEIVED)
+        audio_future: Future[ndarray] = _BACKGROUND_EXECUTOR.submit(load_audio, audio_bytes)
+        # the decode runs off the gil (pyav or an ffmpeg process), so a cold start loads the models meanwhile; afterwards these are cache hits
+        _load_stage_models(low_vram)
+        return _run_stages(audio_future.result(), on_status, batch_size, low_vram)
+    except TranscriptionError as e: raise TranscriptionError(f"transcription with diarization failed: {e}") from e
+    except Exception as e: raise Exception(f"transcription with diarization failed: {e}") from e
+
+def generate_diarized_transcript_from_audio(audio: ndarray, on_status: Callable[[str], None] | None = None,
+                                            batch_size: int = DEFAULT_BATCH_SIZE, low_vram: bool = LOW_VRAM) -> bytes:
+    """
+    generate_diarized_transcript for a waveform that was already decoded with load_audio,
+    so callers with several files can decode the next one while the gpu works on this one
+    """
     try:
         if on_status: on_status(CurrentState.RECEIVED)
-        audio: ndarray = load_audio(audio_bytes)
+        _load_stage_models(low_vram)
+        return _run_stages(audio, on_status, batch_size, low_vram)
+    except TranscriptionError as e: raise TranscriptionError(f"transcription with diarization failed: {e}") from e
+    except Exception as e: raise Exception(f"transcription with diarization failed: {e}") from e
+
+def _load_stage_models(low_vram: bool) -> None:
+    """loads whisper, and the aligner unless low_vram only wants it once whisper is gone"""
+    get_whisper_model()
+    if not low_vram: get_align_model()
+
+def _run_stages(audio: ndarray, on_status: Callable[[str], None] | None, batch_size: int, low_vram: bool) -> bytes:
+    """runs every stage on a decoded waveform, with diarization on a background worker next to the gpu stages unless low_vram"""
+    diarization_future: Future[Annotation] | None = None if low_vram else _BACKGROUND_EXECUTOR.submit(run_diarization_pipeline, audio)
+    try:
         if on_status: on_status(CurrentState.TRANSCRIBING)
-        transcription_result: TranscriptionResult = transcribe_audio(audio)
+        transcription_result: TranscriptionResult = transcribe_audio(audio, batch_size)
+        if low_vram:
+            release_whisper_model()
+            empty_device_cache()
         if on_status: on_status(CurrentState.ALIGNING)
         alignment_result: AlignmentResult = align_transcript_segments(audio, transcription_result.segments)
-        if on_status: on_status(CurrentState.DIARIZING)
-        diarization_result: DataFrame = run_diarization_pipeline(audio)
-        if on_status: on_status(CurrentState.POSTPROCESSING)
-        transcript_bytes: bytes = postprocess_segments(diarization_result, alignment_result)
-        return transcript_bytes
-    except TranscriptionError as e: raise TranscriptionError(f"transcription with diarization failed: {e}") from e
-    except Exception as e: raise Exception(f"transcription with diarization failed: {e}") from e
+        if low_vram:
+            del transcription_result
+            release_align_model()
+            empty_device_cache()
+    except BaseException:
+        # a started diarization can't be cancelled, so the failed job waits for it rather than leaving it on the gpu for the next one
+        if diarization_future and not diarization_future.cancel(): wait((diarization_future,))
+        raise
+    if on_status: on_status(CurrentState.DIARIZING)
+    diarization_result: Annotation = diarization_future.result() if diarization_future else run_diarization_pipeline(audio)
+    if low_vram: empty_device_cache()
+    if on_status: on_status(CurrentState.POSTPROCESSING)
+    transcript_bytes: bytes = postprocess_segments(diarization_result, alignment_result)
+    return transcript_bytes
 
-__all__ = ["generate_diarized_transcript"]
\ No newline at end of file
+__all__ = ["generate_diarized_transcript", "generate_diarized_transcript_from_audio", "load_audio", "load_models", "set_compute_type", "COMPUTE_TYPES", "DEFAULT_BATCH_SIZE", "LOW_VRAM"]
\ No newline at end of file
@@ -0,0 +1,169 @@
+import argparse; import os; import socket; import socketserver; import sys; import tempfile; import ffmpeg
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from hashlib import sha1
+from typing import Iterator
+from numpy import ndarray, load, save
+from pathlib import Path
+
+_DEVNULL_FD: int | None = None # opened once on first use and kept for the life of the process
+
+@contextmanager
+def _silenced(enabled: bool) -> Iterator[None]:
+    """
+    points file descriptors 1 and 2 at /dev/null while enabled, which also catches what c extensions,
+    cuda libraries and subprocesses write, not only python's sys.stdout and sys.stderr
+    """
+    global _DEVNULL_FD
+    if not enabled:
+        yield
+        return
+    if _DEVNULL_FD is None: _DEVNULL_FD = os.open(os.devnull, os.O_WRONLY)
+    sys.stdout.flush(); sys.stderr.flush()
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+    os.dup2(_DEVNULL_FD, 1); os.dup2(_DEVNULL_FD, 2)
+    try: yield
+    finally:
+        sys.stdout.flush(); sys.stderr.flush()
+        os.dup2(saved_stdout, 1); os.dup2(saved_stderr, 2)
+        os.close(saved_stdout); os.close(saved_stderr)
+
+def _probe_duration(path: Path) -> float:
+    """returns the container duration in seconds via ffprobe, 0.0 if it can't be read"""
+    try: return float(ffmpeg.probe(str(path))["format"]["duration"])
+    except Exception: return 0.0
+
+def _sorted_by_duration(input_files: list[Path]) -> list[Path]:
+    """
+    orders files shortest first so that files of similar length are processed next to each other;
+    each probe is an ffprobe process, so they run side by side instead of one after another
+    """
+    with ThreadPoolExecutor(max_workers=min(8, len(input_files)), thread_name_prefix="probe") as prober:
+        durations: list[float] = list(prober.map(_probe_duration, input_files))
+    return [input_file for _, input_file in sorted(zip(durations, input_files), key=lambda pair: pair[0])]
+
+def _output_path(input_file: Path, output_dir: Path | None) -> Path: return (output_dir or input_file.parent) / f"{input_file.stem}.txt"
+
+def _transcribe_file(input_file: Path, output_dir: Path | None, batch_size: int, low_vram: bool) -> Path:
+    """transcribes one file into <output_dir or its own dir>/<name>.txt and returns that path"""
+    from transcription import generate_diarized_transcript
+    output_path: Path = _output_path(input_file, output_dir)
+    transcript_bytes: bytes = generate_diarized_transcript(input_file.read_bytes(), batch_size=batch_size, low_vram=low_vram)
+    output_path.write_bytes(transcript_bytes)
+    return output_path
+
+def _decode_file(input_file: Path, cache_dir: Path | None) -> ndarray:
+    """
+    decodes an input file, or with cache_dir memory-maps the waveform saved by an earlier run
+    a cached waveform is reused as long as it is newer than its input
+    """
+    from transcription import load_audio
+    if cache_dir is None: return load_audio(input_file.read_bytes())
+    # the resolved path is hashed in, so equally named files from different folders don't collide
+    cache_file: Path = cache_dir / f"{input_file.stem}.{sha1(str(input_file.resolve()).encode()).hexdigest()[:12]}.npy"
+    try:
+        # copy-on-write keeps the array writable for torch.from_numpy without reading it up front
+        if cache_file.stat().st_mtime_ns >= input_file.stat().st_mtime_ns: return load(cache_file, mmap_mode="c")
+    except (OSError, ValueError, EOFError): pass # missing or unreadable, decoded again and rewritten below
+    audio: ndarray = load_audio(input_file.read_bytes())
+    # saved under a temporary name and renamed into place, so an interrupted save never leaves a truncated cache file
+    temporary_path: Path | None = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=f".{cache_file.stem}.", suffix=".tmp", delete=False) as temporary_file:
+            temporary_path = Path(temporary_file.name)
+            save(temporary_file, audio)
+        os.replace(temporary_path, cache_file)
+    except OSError as e:
+        print(f"did not cache decoded audio for {input_file}: {e}", file=sys.stderr)
+        if temporary_path: temporary_path.unlink(missing_ok=True)
+    return audio
+
+class _TranscriptionHandler(socketserver.StreamRequestHandler):
+    """reads "<audio path>\t<output dir>" lines and answers each with the transcript path or "error: ..." """
+    def handle(self) -> None:
+        args: argparse.Namespace = self.server.args # type: ignore[attr-defined]
+        for line in self.rfile:
+            input_text, _, output_text = line.decode().rstrip("\n").partition("\t")
+            try:
+                with _silenced(args.quiet): reply: str = str(_transcribe_file(Path(input_text), Path(output_text) if output_text else None, args.batch_size, args.low_vram))
+            except Exception as e: reply = f"error: {e}"
+            self.wfile.write(f"{reply}\n".encode())
+
+def _serve(socket_path: Path, args: argparse.Namespace) -> int:
+    """keeps every model loaded and transcribes files sent over a unix socket, one request at a time"""
+    from transcription import load_models
+    with _silenced(args.quiet): load_models(args.low_vram)
+    socket_path.unlink(missing_ok=True)
+    with socketserver.UnixStreamServer(str(socket_path), _TranscriptionHandler) as server:
+        server.args = args # type: ignore[attr-defined]
+        print(f"serving on {socket_path}")
+        try: server.serve_forever()
+        except KeyboardInterrupt: pass
+    socket_path.unlink(missing_ok=True)
+    return 0
+
+def _submit(socket_path: Path, input_files: list[Path], output_dir: Path | None) -> int:
+    """hands input files to a running --serve process and prints where each transcript was written"""
+    failed: int = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(socket_path))
+        with connection.makefile("rwb") as stream:
+            for input_file in input_files:
+                stream.write(f"{input_file.resolve()}\t{output_dir.resolve() if output_dir else ''}\n".encode())
+                stream.flush()
+                reply: str = stream.readline().decode().rstrip("\n")
+                if not reply or reply.startswith("error: "):
+                    print(f"{input_file}: {reply.removeprefix('error: ') or 'server closed the connection'}", file=sys.stderr)
+                    failed += 1
+                else: print(f"{input_file} -> {reply}")
+    return 1 if failed else 0
+
+def main() -> int:
+    """transcribes every input file in one process so the cached models are loaded only once"""
+    parser = argparse.ArgumentParser(prog="transcription", description="diarized transcription of local audio files")
+    parser.add_argument("input_files", nargs="*", type=Path)
+    parser.add_argument("-o", "--output-dir", type=Path, default=None, help="where to write <name>.txt (defaults to next to each input)")
+    parser.add_argument("--compute-type", default=None, help="whisper compute type: float16, int8_float16, int8 or float32 (defaults to $WHISPER_COMPUTE_TYPE or the fastest one the gpu supports)")
+    parser.add_argument("--batch-size", type=int, default=None, help="vad chunks per whisper forward pass, halved on gpu oom (defaults to $WHISPER_BATCH_SIZE or 16)")
+    parser.add_argument("--low-vram", action="store_true", default=None, help="unload whisper and the aligner after each stage and release cached gpu memory (reloads them per file; defaults to $TRANSCRIPTION_LOW_VRAM)")
+    parser.add_argument("--audio-cache", type=Path, default=None, metavar="DIR", help="keep decoded waveforms here so reruns skip decoding (about 230 mb per hour)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="hide what whisperx, pyannote and cuda print while a file is transcribed")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--serve", type=Path, metavar="SOCKET", help="keep the models loaded and take files over this unix socket")
+    mode.add_argument("--connect", type=Path, metavar="SOCKET", help="send the input files to a --serve process instead of loading models")
+    args = parser.parse_args()
+    if not args.serve and not args.input_files: parser.error("at least one input file is required")
+    if args.output_dir: args.output_dir.mkdir(parents=True, exist_ok=True)
+    if args.connect: return _submit(args.connect, _sorted_by_duration(args.input_files), args.output_dir)
+
+    # the package pulls in torch, whisperx and cuda, so only the processes that run the models import it
+    from transcription import generate_diarized_transcript_from_audio, set_compute_type, DEFAULT_BATCH_SIZE, LOW_VRAM, TranscriptionError
+    if args.compute_type:
+        try: set_compute_type(args.compute_type)
+        except TranscriptionError as e: parser.error(str(e))
+    if args.batch_size is None: args.batch_size = DEFAULT_BATCH_SIZE
+    if args.low_vram is None: args.low_vram = LOW_VRAM
+    if args.audio_cache: args.audio_cache.mkdir(parents=True, exist_ok=True)
+    if args.serve: return _serve(args.serve, args)
+
+    input_files: list[Path] = _sorted_by_duration(args.input_files)
+
+    failed: int = 0
+    # the next file is decoded on the cpu while the gpu works on the current one
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode") as decoder:
+        next_audio: Future[ndarray] = decoder.submit(_decode_file, input_files[0], args.audio_cache)
+        for index, input_file in enumerate(input_files):
+            audio_future: Future[ndarray] = next_audio
+            if index + 1 < len(input_files): next_audio = decoder.submit(_decode_file, input_files[index + 1], args.audio_cache)
+            output_path: Path = _output_path(input_file, args.output_dir)
+            try:
+                with _silenced(args.quiet): transcript_bytes: bytes = generate_diarized_transcript_from_audio(audio_future.result(), batch_size=args.batch_size, low_vram=args.low_vram)
+                output_path.write_bytes(transcript_bytes)
+            except Exception as e:
+                print(f"{input_file}: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            print(f"{input_file} -> {output_path}")
+    return 1 if failed else 0
+
+if __name__ == "__main__": sys.exit(main())
@@ -1,10 +1,15 @@
 import requests; from requests import Response
-from transcription import generate_diarized_transcript
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from transcription import generate_diarized_transcript, load_models
 from dotenv import load_dotenv; from fastapi import FastAPI
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from requests.exceptions import HTTPError
-import asyncio; import os; import jwt; import re; import json; import logging
+import asyncio; import os; import jwt; import re; import json; import logging; import threading
+from collections import OrderedDict
+from hashlib import blake2b
 from asyncio import AbstractEventLoop
+from contextlib import asynccontextmanager
 from typing import Final
 from datetime import datetime
 
@@ -40,12 +45,49 @@ INTERNAL_TOKEN: Final[str] = os.environ.get("INTERNAL_TOKEN", "")
 S3_BUCKET: Final[str] = "https://s3-aged-water-5651.fly.dev"
 FORMAT: Final[str] = "\033[30;43m"
 RESET: Final[str] = "\033[0m"
+# endpoints and headers are fixed for the life of the process, so they are built once
+_S3_QUEUE_URL: Final[str] = f"{S3_BUCKET}/queue"
+_S3_TRANSCRIPTIONS_URL: Final[str] = f"{S3_BUCKET}/transcriptions"
+_AUTH_TRANSCRIPTIONS_URL: Final[str] = f"{AUTH_URL}/transcriptions/add"
+_AUTH_HEADERS: Final[dict[str, str]] = {"X-API-Key": INTERNAL_TOKEN}
+_DOT_RUN_REGEX: Final[re.Pattern[str]] = re.compile(r'[\.]{2,}')
+_UNSAFE_CHAR_REGEX: Final[re.Pattern[str]] = re.compile(r'[^a-zA-Z0-9._-]')
+_PATH_CHAR_TABLE: Final[dict[int, None]] = str.maketrans("", "", "/\\\0") # deletes slashes and null bytes
+TRANSCRIPT_CACHE_SIZE: Final[int] = int(os.environ.get("TRANSCRIPT_CACHE_SIZE", "32")) # finished transcripts kept for resubmitted audio, 0 disables
+
+def _preload_models() -> None:
+    """loads every model ahead of the first upload; a failure here is retried by the first job"""
+    try: load_models()
+    except Exception as e:
+        log_with_extra(logging.WARN, "model preload failed", error=str(e))
+        return
+    log_with_extra(logging.INFO, "models preloaded")
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """
+    starts loading the models in the background so the first upload doesn't pay for it,
+    and on shutdown waits for transcripts that are still being uploaded
+    """
+    threading.Thread(target=_preload_models, name="preload-models", daemon=True).start()
+    yield
+    if _upload_tasks: await asyncio.gather(*_upload_tasks, return_exceptions=True)
+
+# one pooled session for every call to s3 and auth, so each post reuses a kept-alive connection instead of a new tcp+tls handshake;
+# posts are retried with backoff on throttling and gateway errors, so a transient failure doesn't throw away a finished transcript.
+# resending is safe: s3 overwrites queue/{jobid} and transcriptions/{jobid}, and auth answers a repeated jobid with a 409
+_SESSION: Final[requests.Session] = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                       max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504],
+                                                         allowed_methods=["GET", "POST"], raise_on_status=False)))
 
 load_dotenv()
-app = FastAPI()
+app = FastAPI(lifespan=_lifespan)
 queue: list[tuple[str, bytes]] = []
 currently_processing: bool = False
 connections: dict[str, list[WebSocket]] = {}
+_upload_tasks: set[asyncio.Task[None]] = set()
+_transcript_cache: OrderedDict[bytes, bytes] = OrderedDict() # audio digest -> transcript, least recently used first
 
 log_with_extra(logging.INFO, "transcription service initialized", auth_url=AUTH_URL, s3_bucket=S3_BUCKET)
 
@@ -53,9 +95,9 @@ def _sanitise_filename(filename: str | None) -> str:
     """sanitises a filename to remove path traversal and special characters"""
     if not filename:
         return "audio"
-    sanitised = re.sub(r'[\.]{2,}', '', filename)  # remove ..
-    sanitised = re.sub(r'[/\\\0]', '', sanitised)  # remove slashes and null bytes
-    sanitised = re.sub(r'[^a-zA-Z0-9._-]', '_', sanitised)  # replace special chars
+    sanitised = _DOT_RUN_REGEX.sub('', filename)  # remove ..
+    sanitised = sanitised.translate(_PATH_CHAR_TABLE)  # remove slashes and null bytes
+    sanitised = _UNSAFE_CHAR_REGEX.sub('_', sanitised)  # replace special chars
     return sanitised[:255] if sanitised else "audio"
 
 def _post_audio_to_s3(jobid: str, audio_bytes: bytes, filename: str | None) -> None:
@@ -66,7 +108,7 @@ def _post_audio_to_s3(jobid: str, audio_bytes: bytes, filename: str | None) -> N
     }
     data: dict[str, str] = {"jobid": jobid}
     log_with_extra(logging.DEBUG, "posting audio to s3", jobid=jobid, filename=safe_filename, size=len(audio_bytes))
-    resp: Response = requests.post(f"{S3_BUCKET}/queue", files=files, data=data)
+    resp: Response = _SESSION.post(_S3_QUEUE_URL, files=files, data=data)
     resp.raise_for_status()
     log_with_extra(logging.INFO, "audio posted to s3", jobid=jobid, status=resp.status_code)
 
@@ -78,7 +120,7 @@ def _post_transcription_to_s3(jobid: str, transcript_bytes: bytes) -> None:
     }
     data: dict[str, str] = {"jobid": jobid}
     log_with_extra(logging.DEBUG, "posting transcription to s3", jobid=jobid, size=len(transcript_bytes))
-    resp: Response = requests.post(f"{S3_BUCKET}/transcriptions", files=files, data=data)
+    resp: Response = _SESSION.post(_S3_TRANSCRIPTIONS_URL, files=files, data=data)
     resp.raise_for_status()
     log_with_extra(logging.INFO, "transcription posted to s3", jobid=jobid, status=resp.status_code)
 
@@ -95,8 +137,38 @@ async def broadcast(jobid: str, message: dict):
             dead.append(websocket)
     for websocket in dead: connections[jobid].remove(websocket)
 
+def _audio_digest(audio_bytes: bytes) -> bytes:
+    """content hash of an audio blob, so a retried or duplicated upload is recognised whatever its job id"""
+    return blake2b(audio_bytes, digest_size=16).digest()
+
+def _cache_transcript(digest: bytes, transcript_bytes: bytes) -> None:
+    """remembers a successful transcript and evicts the least recently used ones past TRANSCRIPT_CACHE_SIZE"""
+    if TRANSCRIPT_CACHE_SIZE <= 0: return
+    _transcript_cache[digest] = transcript_bytes
+    _transcript_cache.move_to_end(digest)
+    while len(_transcript_cache) > TRANSCRIPT_CACHE_SIZE: _transcript_cache.popitem(last=False)
+
+async def _upload_transcription(jobid: str, transcript_bytes: bytes, failed: bool) -> None:
+    """posts a finished transcript from a worker thread, then reports the job as completed and drops its websockets"""
+    try: await asyncio.to_thread(_post_transcription_to_s3, jobid, transcript_bytes)
+    except Exception as e:
+        log_with_extra(logging.ERROR, "transcription upload failed", jobid=jobid, error=str(e))
+        if not failed: await broadcast(jobid, {"status": "error", "error": f"transcription upload failed for job '{jobid}': {e}"})
+    else:
+        if not failed:
+            await broadcast(jobid, {"status": "completed"})
+            log_with_extra(logging.INFO, "job completed", jobid=jobid, transcript_size=len(transcript_bytes))
+    finally:
+        connections.pop(jobid, None)
+
+def _schedule_upload(jobid: str, transcript_bytes: bytes, failed: bool = False) -> None:
+    """starts the transcript upload in the background so the next job's gpu work doesn't wait on s3"""
+    task: asyncio.Task[None] = asyncio.create_task(_upload_transcription(jobid, transcript_bytes, failed))
+    _upload_tasks.add(task) # the loop only keeps weak references to tasks
+    task.add_done_callback(_upload_tasks.discard)
+
 async def _process_queue() -> None:
-    """process all jobs that are in queue"""
+    """process all jobs that are in queue; each transcript is uploaded while the next job is already transcribing"""
     global queue
     global currently_processing
     while queue:
@@ -108,34 +180,38 @@ async def _process_queue() -> None:
         def _threadsafe_status(status: str) -> None:
             asyncio.run_coroutine_threadsafe(broadcast(jobid, {"status": status}), loop)
         try:
+            # hashing large buffers releases the gil, so it runs off the event loop
+            digest: bytes = await asyncio.to_thread(_audio_digest, audio_bytes)
+            cached: bytes | None = _transcript_cache.get(digest)
+            if cached is not None:
+                _transcript_cache.move_to_end(digest)
+                log_with_extra(logging.INFO, "transcript served from cache", jobid=jobid)
+                _schedule_upload(jobid, cached)
+                continue
             transcript_bytes: bytes = await asyncio.to_thread(
                 generate_diarized_transcript,
                 audio_bytes=audio_bytes,
                 on_status=_threadsafe_status,
             )
-            _post_transcription_to_s3(jobid, transcript_bytes)
-            await broadcast(jobid, {"status": "completed"})
-            log_with_extra(logging.INFO, "job completed", jobid=jobid, transcript_size=len(transcript_bytes))
+            _cache_transcript(digest, transcript_bytes)
+            _schedule_upload(jobid, transcript_bytes)
 
         except Exception as e:
             error_text: str = f"transcription failed for job '{jobid}': {e}"
             log_with_extra(logging.ERROR, "job failed", jobid=jobid, error=str(e))
             await broadcast(jobid, {"status": "error", "error": error_text})
-            _post_transcription_to_s3(jobid, error_text.encode("utf-8"))
+            _schedule_upload(jobid, error_text.encode("utf-8"), failed=True)
         finally: 
             currently_processing = False
             queue.pop(0)
-            if jobid in connections:
-                del connections[jobid]
             log_with_extra(logging.DEBUG, "job removed from queue", jobid=jobid, remaining=len(queue))
 
 
 def _post_jobid_to_auth(jobid: str, email: str, filename: str) -> None:
     """posts a transcription job id and user email to the auth api"""
     data: dict[str, str] = {"jobid": jobid, "email": email, "filename": filename}
-    headers: dict[str, str] = {"X-API-Key": INTERNAL_TOKEN}
     log_with_extra(logging.DEBUG, "posting jobid to auth", jobid=jobid, email=email)
-    resp: Response = requests.post(f"{AUTH_URL}/transcriptions/add", json=data, headers=headers)
+    resp: Response = _SESSION.post(_AUTH_TRANSCRIPTIONS_URL, json=data, headers=_AUTH_HEADERS)
     try:
         resp.raise_for_status()
         log_with_extra(logging.INFO, "jobid registered with auth", jobid=jobid, email=email)
@@ -153,7 +229,10 @@ def _decode_jwt_email(token: str | None) -> str | None:
 
 @app.post("/upload")
 async def upload(request: Request, file: UploadFile = File(...), jobid: str = Form(...)) -> dict[str, str]:
-    """receives an audio blob and a job id, and either forwards the audio to s3 or runs local transcription"""
+    """
+    receives an audio blob and a job id, and either forwards the audio to s3 or runs local transcription
+    the s3 and auth posts run on worker threads so websocket status updates and the queue loop aren't held up by them
+    """
 
     global queue
     global currently_processing
@@ -170,7 +249,7 @@ async def upload(request: Request, file: UploadFile = File(...), jobid: str = Fo
     if currently_processing:
         # posts the audio file to s3 bucket's /queue if currently transcribing
         log_with_extra(logging.INFO, "job queued (processing in progress)", jobid=jobid)
-        _post_audio_to_s3(jobid, audio_bytes, file.filename)        
+        await asyncio.to_thread(_post_audio_to_s3, jobid, audio_bytes, file.filename)
         return {"jobid": jobid, "status": "queued"}
     
     if jobid is None: jobid = "you did not provide a jobid"
@@ -181,7 +260,7 @@ async def upload(request: Request, file: UploadFile = File(...), jobid: str = Fo
         log_with_extra(logging.ERROR, "failed to create processing task", jobid=jobid, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if jwt_email: _post_jobid_to_auth(jobid, jwt_email, file.filename)
+        if jwt_email: await asyncio.to_thread(_post_jobid_to_auth, jobid, jwt_email, file.filename)
         return {"jobid": jobid, "status": "accepted"}
 
 @app.websocket("/ws/status")
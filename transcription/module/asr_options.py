@@ -0,0 +1,10 @@
+from typing import Final
+
+# decoding options for whisperx.load_model, merged over whisperx's own defaults;
+# whisperx cuts the audio at vad boundaries into chunks of up to chunk_size seconds and decodes them batch_size at a time,
+# so these only shape how each chunk is decoded
+asr_options: Final[dict[str, object]] = {
+    "beam_size": 5,
+    "condition_on_previous_text": False, # chunks are decoded side by side, there is no previous text to condition on
+    "suppress_numerals": False,
+}
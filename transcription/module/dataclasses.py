@@ -1,29 +1,31 @@
 from dataclasses import dataclass, field
+from numpy import ndarray
 
 # internal data structures
+# the per-segment and per-word types use slots, thousands of them are built per hour of audio
 
 class TranscriptionError(Exception): pass
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Duration:
     """time bounds in seconds [start, end)"""
     start: float
     end: float
 
-@dataclass
+@dataclass(slots=True)
 class Segment:
     """text segment with timing"""
     duration: Duration
     text: str
 
-@dataclass
+@dataclass(slots=True)
 class WordEntry:
     """word-level entry attached to aligned segments from whisperx"""
     duration: Duration
     word: str
     speaker: str | None
 
-@dataclass
+@dataclass(slots=True)
 class WordAlignedSegment(Segment):
     """segment with text decomposed into word aligned entries"""
     words: list[WordEntry] = field(default_factory=list)
@@ -40,20 +42,30 @@ class TranscriptionResult:
     """output of transcription from whisperx"""
     segments: list[Segment]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SpeakerSegment:
     """diarization-only speaker turn, no text"""
     duration: Duration
     label:str
 
-@dataclass
+@dataclass(frozen=True, slots=True)
+class SpeakerTurns:
+    """diarization turns as parallel arrays sorted by (start, end); label_ids index into labels"""
+    starts: ndarray
+    ends: ndarray
+    reach: ndarray # running max of ends, sorted, so searchsorted on it skips turns that have already ended
+    label_ids: ndarray
+    labels: ndarray
+    turn_labels: list[str] # labels[label_ids] as plain strs, shared by the per-word passes
+
+@dataclass(frozen=True, slots=True)
 class Utterance:
     """final merged utterance"""
     duration: Duration
     speaker: str
     text:str
 
-@dataclass
+@dataclass(slots=True)
 class DiarizationSegment:
     """a single diarization segment"""
     duration: Duration
@@ -1,4 +1,5 @@
-import os; import torch; import whisperx
+import os; import threading; import torch; import whisperx; import ctranslate2
+from numpy import zeros, float32
 from typing import cast, Final
 from whisperx.asr import FasterWhisperPipeline
 from whisperx.diarize import DiarizationPipeline
@@ -8,53 +9,145 @@ from transcription.module.asr_options import asr_options
 # determines the n of speakers and how often segments are merged or split across speakers
 DIARIZATION_CLUSTER_THRESHOLD: Final[float] = 0.5 # try lowering to reduce overmerging
 _DEVICE: Final[str] = "cuda" # required for diarization on gpu
+# diarization already runs next to whisper and alignment on a worker thread; on a multi-gpu host, e.g. cuda:1 gives it a device of its own
+_DIARIZATION_DEVICE: Final[str] = os.environ.get("DIARIZATION_DEVICE", _DEVICE)
+# windows per pyannote forward pass; its default of 32 can run out of memory next to whisper on small gpus, 0 keeps that default
+_DIARIZATION_SEGMENTATION_BATCH_SIZE: Final[int] = int(os.environ.get("DIARIZATION_SEGMENTATION_BATCH_SIZE", "0"))
+_DIARIZATION_EMBEDDING_BATCH_SIZE: Final[int] = int(os.environ.get("DIARIZATION_EMBEDDING_BATCH_SIZE", "0"))
+# ctranslate2 compute types for whisper; int8_float16 keeps int8 weights with fp16 activations for smaller gpus
+COMPUTE_TYPES: Final[tuple[str, ...]] = ("float16", "int8_float16", "int8", "float32")
+_COMPUTE_TYPE: str = os.environ.get("WHISPER_COMPUTE_TYPE", "") # empty picks the fastest type the gpu supports
+# opt-in since compiling adds a one-off warmup to the first diarization load
+_COMPILE_DIARIZATION: Final[bool] = os.environ.get("DIARIZATION_COMPILE", "") == "1"
+_COMPILE_ALIGNMENT: Final[bool] = os.environ.get("ALIGNMENT_COMPILE", "") == "1"
 _ALIGN_MODEL: torch.nn.Module | None = None
 _ALIGN_METADATA: AlignMetadata | None = None
 _DIARIZATION_PIPELINE: DiarizationPipeline | None = None
 _WHISPER_MODEL: FasterWhisperPipeline | None = None
+_DIARIZATION_LOCK: Final[threading.Lock] = threading.Lock() # diarization is loaded from a worker thread
+# whisper and the aligner can be preloaded in the background while the first request asks for them
+_WHISPER_LOCK: Final[threading.Lock] = threading.Lock()
+_ALIGN_LOCK: Final[threading.Lock] = threading.Lock()
 
 # for loading the pyannote diarization model
 _token: str | None = os.environ.get("HF_TOKEN")
 if _token is None or _token.strip() == "": raise TranscriptionError("hf_token is not set")
 _HF_TOKEN: Final[str] = _token
 if not torch.cuda.is_available(): raise TranscriptionError("cuda is unavailable. https://developer.nvidia.com/cuda-downloads")
+if _COMPUTE_TYPE and _COMPUTE_TYPE not in COMPUTE_TYPES: raise TranscriptionError(f"unsupported whisper compute type '{_COMPUTE_TYPE}'")
 
 def get_device() -> str: return _DEVICE
 
+def set_compute_type(compute_type: str) -> None:
+    """sets the whisper compute type, only has an effect before the model is first loaded"""
+    global _COMPUTE_TYPE
+    if compute_type not in COMPUTE_TYPES: raise TranscriptionError(f"unsupported whisper compute type '{compute_type}'")
+    _COMPUTE_TYPE = compute_type
+
 def get_whisper_model() -> FasterWhisperPipeline:
     """loads and caches the whisperx large model"""
     global _WHISPER_MODEL
     if _WHISPER_MODEL is not None: return _WHISPER_MODEL
+    with _WHISPER_LOCK:
+        if _WHISPER_MODEL is None: _WHISPER_MODEL = _load_whisper_model()
+    return cast(FasterWhisperPipeline, _WHISPER_MODEL)
+
+def _default_compute_type() -> str:
+    """the first of COMPUTE_TYPES that ctranslate2 supports on this gpu: float16 from volta on, int8_float16 or int8 before"""
+    try: supported: set[str] = ctranslate2.get_supported_compute_types(_DEVICE)
+    except Exception: return "float16"
+    return next((compute_type for compute_type in COMPUTE_TYPES if compute_type in supported), "float32")
+
+def _load_whisper_model() -> FasterWhisperPipeline:
+    """loads the whisperx large model, in float32 if the configured compute type isn't supported"""
     model_name: str = "large"
+    compute_type: str = _COMPUTE_TYPE or _default_compute_type()
 
-    try: model: FasterWhisperPipeline = whisperx.load_model(model_name, _DEVICE, compute_type="float16", asr_options=asr_options)
+    try: model: FasterWhisperPipeline = whisperx.load_model(model_name, _DEVICE, compute_type=compute_type, asr_options=asr_options)
     except ValueError as e:
         message = str(e).lower()
-        if "float16" in message: model = whisperx.load_model(model_name, _DEVICE, compute_type="float32")
+        if compute_type != "float32" and compute_type in message:
+            model = whisperx.load_model(model_name, _DEVICE, compute_type="float32", asr_options=asr_options)
         else: raise Exception(f"failed to load model '{model_name}': {e}") from e
     except TranscriptionError as e: raise TranscriptionError(f"failed to load model '{model_name}': {e}") from e
     except Exception as e: raise Exception(f"model '{model_name}' failed to load: {e}") from e
-
-    _WHISPER_MODEL = model
     return model
 
+def release_whisper_model() -> None:
+    """drops the cached whisper model so its memory can be freed; the next get_whisper_model loads it again"""
+    global _WHISPER_MODEL
+    with _WHISPER_LOCK: _WHISPER_MODEL = None
+
 def get_align_model() -> tuple[torch.nn.Module, AlignMetadata]:
     """loads and caches the whisperx alignment model and its metadata"""
     global _ALIGN_MODEL, _ALIGN_METADATA
     if _ALIGN_MODEL is None or _ALIGN_METADATA is None:
-        model, meta = whisperx.load_align_model(language_code="en", device=_DEVICE)
-        _ALIGN_MODEL = model
-        _ALIGN_METADATA = align_metadata_from_whisper(meta)
+        with _ALIGN_LOCK:
+            if _ALIGN_MODEL is None or _ALIGN_METADATA is None:
+                model, meta = whisperx.load_align_model(language_code="en", device=_DEVICE)
+                if _COMPILE_ALIGNMENT:
+                    try: model = _compile_align_model(model)
+                    except Exception as e: print(f"did not compile alignment model: {e}")
+                _ALIGN_METADATA = align_metadata_from_whisper(meta)
+                _ALIGN_MODEL = model
     return cast(torch.nn.Module, _ALIGN_MODEL), cast(AlignMetadata, _ALIGN_METADATA)
 
+def release_align_model() -> None:
+    """drops the cached alignment model so its memory can be freed; the next get_align_model loads it again"""
+    global _ALIGN_MODEL, _ALIGN_METADATA
+    with _ALIGN_LOCK: _ALIGN_MODEL, _ALIGN_METADATA = None, None
+
 def get_diarization_pipeline() -> DiarizationPipeline:
     """loads and caches the pyannote diarization pipeline used by whisperx"""
     global _DIARIZATION_PIPELINE
-    if _DIARIZATION_PIPELINE is None:
-        # https://github.com/m-bain/whisperX/issues/499 -- do NOT switch from the 2.1 model
-        _DIARIZATION_PIPELINE = DiarizationPipeline(model_name="pyannote/speaker-diarization@2.1", use_auth_token=_HF_TOKEN, device=_DEVICE)
-        try:
-            _DIARIZATION_PIPELINE.set_params({"clustering": {"threshold": DIARIZATION_CLUSTER_THRESHOLD}})
-        except Exception as e:
-            print(f"did not set diarization clustering threshold: {e}")
+    if _DIARIZATION_PIPELINE is not None: return _DIARIZATION_PIPELINE
+    with _DIARIZATION_LOCK:
+        if _DIARIZATION_PIPELINE is None:
+            # https://github.com/m-bain/whisperX/issues/499 -- do NOT switch from the 2.1 model
+            pipeline = DiarizationPipeline(model_name="pyannote/speaker-diarization@2.1", use_auth_token=_HF_TOKEN, device=_DIARIZATION_DEVICE)
+            try:
+                pipeline.set_params({"clustering": {"threshold": DIARIZATION_CLUSTER_THRESHOLD}})
+            except Exception as e:
+                print(f"did not set diarization clustering threshold: {e}")
+            try: _set_diarization_batch_sizes(pipeline)
+            except Exception as e: print(f"did not set diarization batch sizes: {e}")
+            if _COMPILE_DIARIZATION:
+                try: _compile_diarization_models(pipeline)
+                except Exception as e: print(f"did not compile diarization models: {e}")
+            _DIARIZATION_PIPELINE = pipeline
     return cast(DiarizationPipeline, _DIARIZATION_PIPELINE)
+
+def _set_diarization_batch_sizes(pipeline: DiarizationPipeline) -> None:
+    """applies the configured segmentation and embedding batch sizes to pyannote's pipeline, before any compile warmup sees them"""
+    inner = pipeline.model
+    if _DIARIZATION_SEGMENTATION_BATCH_SIZE > 0: inner._segmentation.batch_size = _DIARIZATION_SEGMENTATION_BATCH_SIZE
+    if _DIARIZATION_EMBEDDING_BATCH_SIZE > 0: inner.embedding_batch_size = _DIARIZATION_EMBEDDING_BATCH_SIZE
+
+def _compile_align_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    compiles the wav2vec2 alignment model with dynamic shapes, since every segment is a different length,
+    and pays the compile cost on a second of silence; the eager model is kept if either step fails
+    """
+    compiled = torch.compile(model, dynamic=True)
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+        compiled(torch.zeros(1, 16000, device=_DEVICE))
+    return compiled
+
+def _compile_diarization_models(pipeline: DiarizationPipeline) -> None:
+    """
+    wraps pyannote's segmentation and embedding networks with torch.compile and pays the compile cost on a second of silence
+    the eager networks are put back if compiling or the warmup fails
+    """
+    inner = pipeline.model
+    segmentation = getattr(inner, "_segmentation", None)
+    embedding = getattr(inner, "_embedding", None)
+    eager_segmentation = segmentation.model if segmentation is not None else None
+    eager_embedding = getattr(embedding, "model_", None)
+    try:
+        if eager_segmentation is not None: segmentation.model = torch.compile(eager_segmentation, mode="reduce-overhead")
+        if eager_embedding is not None: embedding.model_ = torch.compile(eager_embedding, mode="reduce-overhead")
+        pipeline(zeros(16000, dtype=float32))
+    except Exception:
+        if eager_segmentation is not None: segmentation.model = eager_segmentation
+        if eager_embedding is not None: embedding.model_ = eager_embedding
+        raise
@@ -1,25 +1,65 @@
-import ffmpeg; import torch; import whisperx
-from numpy import ndarray, frombuffer, clip, dtype
+import ffmpeg; import gc; import os; import torch; import whisperx
+from numpy import ndarray, frombuffer, multiply, float32, dtype, float64, isfinite, lexsort, maximum, minimum, searchsorted, bincount, zeros, arange, array
 from shutil import which
+from bisect import bisect_right
+import fcntl
 import tempfile
 import subprocess
-from typing import Final
-from pandas import DataFrame
+from threading import Thread
+from typing import BinaryIO, Final
+from pandas import DataFrame, factorize, notna
+from pyannote.core import Annotation
 from whisperx.asr import FasterWhisperPipeline
+from faster_whisper.audio import decode_audio
+from io import BytesIO
+import soundfile
 from .dataclasses import TranscriptionError, TranscriptionResult, \
-    Segment, AlignmentResult, alignment_result_from_whisper, \
-    alignment_result_to_whisper, transcription_result_from_whisper, segment_to_whisper
+    Segment, SpeakerTurns, WordEntry, WordAlignedSegment, AlignmentResult, alignment_result_from_whisper, \
+    transcription_result_from_whisper, segment_to_whisper
 from .models import get_align_model, get_diarization_pipeline, get_device, get_whisper_model
 
 DEVICE: Final[str] = get_device()
+SAMPLE_RATE: Final[int] = 16000 # what whisper, the aligner and pyannote expect
+DEFAULT_BATCH_SIZE: Final[int] = int(os.environ.get("WHISPER_BATCH_SIZE", "16")) # vad chunks per whisper forward pass
+CHUNK_SIZE: Final[int] = int(os.environ.get("WHISPER_CHUNK_SIZE", "30")) # longest vad chunk in seconds, whisper's window is 30
+LOW_VRAM: Final[bool] = os.environ.get("TRANSCRIPTION_LOW_VRAM", "") == "1" # release cached cuda memory between stages
+_OVERLAP_CHUNK_CELLS: Final[int] = 1 << 22 # caps each interval x turn overlap matrix at 32 mb of float64
 _FFMPEG_AVAILABLE: Final[bool] = which("ffmpeg") is not None # caching ffmpeg presence so that it's not called repeatedly
+_INT16_SCALE: Final[float32] = float32(1.0 / 32768.0)
+_PIPE_SIZE: Final[int] = 1 << 20 # the default linux pipe holds 64 kb
+_MP4_BOX_TYPE: Final[bytes] = b"ftyp" # bytes 4-8 of mp4/m4a/mov files, which need a seekable input
 
 def load_audio(data:bytes) -> ndarray:
     """
-    creates a temporary file from the input, decodes it into a mono 16 khz float32 waveform via ffmpeg
+    decodes the input into a mono 16 khz float32 waveform, in-process with pyav (faster-whisper's decoder) when it can,
+    otherwise with an ffmpeg subprocess; pcm wav that is already 16 khz mono is read directly with soundfile
     returns a 1d numpy array with samples normalised to [-1.0, 1.0] per whisperx's wants
     """
+    # pcm wav that is already 16 khz mono only needs its samples scaled, no decoder or resampler
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try: audio: ndarray | None = _load_audio_wav(data)
+        except Exception: audio = None
+        if audio is not None and audio.size: return audio
+    # a BytesIO is seekable, so mp4/m4a containers with a trailing moov atom decode fine here as well
+    try: audio = decode_audio(BytesIO(data), sampling_rate=SAMPLE_RATE)
+    except Exception: audio = None # codecs pyav can't handle still get the ffmpeg binary
+    if audio is not None and audio.size: return audio
+    return _load_audio_ffmpeg(data)
+
+def _load_audio_wav(data: bytes) -> ndarray | None:
+    """
+    reads a wav with libsndfile if it is already integer pcm, mono, at SAMPLE_RATE, otherwise returns None
+    float wavs are left to the decoders, since their samples aren't bounded to [-1.0, 1.0]
+    """
+    with soundfile.SoundFile(BytesIO(data)) as wav_file:
+        if wav_file.samplerate != SAMPLE_RATE or wav_file.channels != 1 or not wav_file.subtype.startswith("PCM"): return None
+        return wav_file.read(dtype="float32")
+
+def _load_audio_ffmpeg(data: bytes) -> ndarray:
+    """decodes the input into a mono 16 khz float32 waveform via ffmpeg, through a temporary file only for mp4 containers"""
     if not _FFMPEG_AVAILABLE: raise TranscriptionError("ffmpeg not found. https://ffmpeg.org/download.html")
+    # every other container decodes from a pipe in order, so it never touches the disk
+    if data[4:8] != _MP4_BOX_TYPE: return _run_ffmpeg("pipe:0", data)
 
     # .m4a is in the mp4 family. to parse mp4 containers, parser would need random access to 
     # get the moov atom (the index and timing info), which is placed at the end of mp4 containers;
@@ -31,91 +71,282 @@ def load_audio(data:bytes) -> ndarray:
         temporary_file.write(data)
         # ensure the new file is out of the buffer so ffmpeg doesn't think the file is partial
         temporary_file.flush() 
+        return _run_ffmpeg(temporary_file.name, None)
+
+def _run_ffmpeg(input_url: str, piped_input: bytes | None) -> ndarray:
+    """runs ffmpeg on a file path, or on pipe:0 fed with piped_input, and reads the s16le samples from its stdout"""
+    ffmpeg_cmd = [
+        "ffmpeg",
+        *(() if piped_input is not None else ("-nostdin",)), # disables standard input unless the audio comes through it
+        "-loglevel", "error", # only spew out errors
+        "-i", input_url,
+        "-ac", "1", # not sure whether setting it to mono actually improves anything
+        "-ar", str(SAMPLE_RATE), # sample rate 16 kHz
+        # pcm 16 bit little-endian, like pyav's decode: half the pipe traffic of f32le and always within [-1.0, 1.0) once scaled
+        "-f", "s16le",
+        "pipe:1",
+    ]
+
+    # a file input never touches stdin (-nostdin), so don't pipe the audio in a second time
+    process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.DEVNULL if piped_input is None else subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    # communicate() would push the input through select() in 4 kb writes and join the output from 32 kb reads;
+    # instead stdin is written in one call and stderr drained on helper threads, and stdout is read to eof into one buffer
+    stderr_output: list[bytes] = []
+    helpers: list[Thread] = [Thread(target=lambda: stderr_output.append(process.stderr.read()), daemon=True)]
+    if piped_input is not None:
+        _widen_pipe(process.stdin)
+        helpers.append(Thread(target=_feed_pipe, args=(process.stdin, piped_input), daemon=True))
+    _widen_pipe(process.stdout)
+    for helper in helpers: helper.start()
+    pcm: bytes = process.stdout.read()
+    for helper in helpers: helper.join()
+    if process.wait() != 0: raise TranscriptionError(b"".join(stderr_output).decode(errors="ignore"))
+
+    if not pcm: raise RuntimeError("decoded audio is empty")
+    # one ufunc pass reads int16 and writes the scaled float32, with no float64 or unscaled float32 temporary
+    return multiply(frombuffer(pcm, dtype=dtype("<i2")), _INT16_SCALE, dtype=float32)
+
+def _feed_pipe(pipe: BinaryIO, data: bytes) -> None:
+    """writes all of data into a subprocess pipe and closes it, ignoring a reader that exited early"""
+    try:
+        # stdin is unbuffered, so each write is one write(2) that may come back short (a signal, or linux's ~2 gb cap per call)
+        remaining = memoryview(data)
+        while remaining: remaining = remaining[pipe.write(remaining):]
+    except BrokenPipeError: pass # ffmpeg already failed, its stderr says why
+    finally:
+        try: pipe.close()
+        except BrokenPipeError: pass
+
+def _widen_pipe(pipe: BinaryIO) -> None:
+    """grows a pipe's kernel buffer to _PIPE_SIZE where the platform allows it, so large transfers need fewer syscalls"""
+    try: fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, _PIPE_SIZE)
+    except (AttributeError, OSError): pass # not linux, or above /proc/sys/fs/pipe-max-size
 
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-nostdin", # disables standard input
-            "-loglevel", "error", # only spew out errors
-            "-i", temporary_file.name,
-            "-ac", "1", # not sure whether setting it to mono actually improves anything
-            "-ar", "16000", # sample rate 16 kHz
-            "-f", "f32le", # output format pcm 32 bit float little-endian
-            "pipe:1", 
-        ]
-
-        process = subprocess.run(ffmpeg_cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if process.returncode != 0: raise TranscriptionError(process.stderr.decode(errors="ignore"))
-        
-        if not process.stdout: raise RuntimeError("decoded audio is empty")
-        audio = frombuffer(process.stdout, dtype=dtype("<f4"))
-        return clip(audio, -1.0, 1.0)
-
-def transcribe_audio(audio: ndarray) -> TranscriptionResult:
-    """run transcription on audio and return raw segments via cached whisperx model"""
+def empty_device_cache() -> None:
+    """collects dropped python references and hands cached but unused cuda blocks back to the driver"""
+    gc.collect()
+    torch.cuda.empty_cache()
+    torch.cuda.ipc_collect()
+
+def transcribe_audio(audio: ndarray, batch_size: int = DEFAULT_BATCH_SIZE) -> TranscriptionResult:
+    """
+    run transcription on audio and return raw segments via cached whisperx model
+    vad chunks are decoded batch_size at a time; the batch is halved and retried if the gpu runs out of memory
+    """
     whisper_model: FasterWhisperPipeline = get_whisper_model()
-    with torch.inference_mode(): raw = whisper_model.transcribe(audio, language="en", task="transcribe")
-    return transcription_result_from_whisper(raw)
+    while True:
+        try:
+            with torch.inference_mode():
+                raw = whisper_model.transcribe(audio, batch_size=batch_size, chunk_size=CHUNK_SIZE, language="en", task="transcribe")
+            return transcription_result_from_whisper(raw)
+        except RuntimeError as e: # ctranslate2 reports cuda oom as a plain RuntimeError, torch's oom subclasses it
+            if batch_size <= 1 or "out of memory" not in str(e).lower(): raise
+            torch.cuda.empty_cache()
+            batch_size //= 2
 
 def align_transcript_segments(audio: ndarray, segments: list[Segment]) -> AlignmentResult:
     """aligns raw whisperx segments to audio via the cached alignment model"""
     align_model, align_metadata = get_align_model()
     whisper_segments = [segment_to_whisper(s) for s in segments]
-    raw = whisperx.align(whisper_segments, align_model, 
-                         {"language": align_metadata.language, 
-                          "dictionary": align_metadata.dictionary, 
-                          "type": align_metadata.type}, audio, DEVICE)
+    # whisperx.align slices the waveform per segment and moves every slice to the device;
+    # uploading the whole waveform once turns those per-segment copies into no-ops
+    waveform: torch.Tensor = torch.from_numpy(audio).to(DEVICE)
+    # no autograd bookkeeping, and the wav2vec2 forward runs on fp16 tensor cores (log_softmax stays fp32 under autocast)
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+        raw = whisperx.align(whisper_segments, align_model, 
+                             {"language": align_metadata.language, 
+                              "dictionary": align_metadata.dictionary, 
+                              "type": align_metadata.type}, waveform, DEVICE)
     return alignment_result_from_whisper(raw)
 
-def run_diarization_pipeline(audio: ndarray) -> DataFrame:
+def run_diarization_pipeline(audio: ndarray) -> Annotation:
     """runs speaker diarization on audio via the cached diarization pipeline"""
     diarization_pipeline = get_diarization_pipeline()
-    diarization_result: DataFrame = diarization_pipeline(audio, min_speakers=2, max_speakers=5)
+    # calls pyannote directly: the whisperx wrapper only rebuilds its annotation into a dataframe row by row
+    audio_data: dict = {"waveform": torch.from_numpy(audio[None, :]), "sample_rate": SAMPLE_RATE}
+    diarization_result: Annotation = diarization_pipeline.model(audio_data, min_speakers=2, max_speakers=5)
     return diarization_result
 
-def postprocess_segments(diarization_result: DataFrame, alignment_result: AlignmentResult) -> bytes:
-    """merges word level speakers and timings into final utterances and formats the transcript"""
-    aligned_dict: dict = alignment_result_to_whisper(alignment_result)
-    aligned_dict = whisperx.assign_word_speakers(diarization_result, aligned_dict)
-    alignment_result: AlignmentResult = alignment_result_from_whisper(aligned_dict)
-    _fill_missing_word_speakers(alignment_result, diarization_result)
+def postprocess_segments(diarization_result: Annotation | DataFrame, alignment_result: AlignmentResult) -> bytes:
+    """
+    merges word level speakers and timings into final utterances and formats the transcript
+    word speakers are written into alignment_result in place
+    """
+    turns: SpeakerTurns = _normalize_diarization_turns(diarization_result)
+    _assign_word_speakers(alignment_result, turns)
 
-    lines: list[str] = []
+    # each line is encoded straight into the output buffer, so there is no list of lines
+    # and no joined str that has to be encoded again at the end
+    transcript = bytearray()
+    format_timestamp, join_words = _format_timestamp, _join_words
     for segment in alignment_result.segments:
         words = [word for word in segment.words if isinstance(word.word, str)]
         if not words: continue
-        start = float(words[0].duration.start)
-        speaker = str(words[0].speaker or "UNKNOWN")
-        text = " ".join(word.word for word in words)
-        lines.append(f"[{_format_timestamp(start)}] {speaker}: {text}")
-    return "\n".join(lines).encode("utf-8")
+        first_word = words[0]
+        start = first_word.duration.start
+        speaker = str(first_word.speaker or "UNKNOWN")
+        text = join_words(words)
+        if transcript: transcript += b"\n"
+        transcript += f"[{format_timestamp(start)}] {speaker}: {text}".encode("utf-8")
+    return bytes(transcript)
 
-
-def _fill_missing_word_speakers(alignment_result: AlignmentResult, diarization_result: DataFrame) -> None:
+def _normalize_diarization_turns(diarization_result: Annotation | DataFrame) -> SpeakerTurns:
+    """
+    turns diarization output into labelled speaker turns sorted by (start, end)
+    pyannote annotations are read straight from itertracks, whisperx-style dataframes by column
     """
-    fills missing word "speaker" fields in alignment_result using diarization turns
-    builds time intervals from diarization_result and 
-    assigns the interval speaker to words whose start time falls inside an interval"""
-    diarization_intervals = []
-    for _, diarization_row in diarization_result.iterrows():
-        if "start" in diarization_row and "end" in diarization_row:
-            diarization_intervals.append(
-                (float(diarization_row["start"]), float(diarization_row["end"]),
-                str(diarization_row.get("speaker") or diarization_row.get("label") or "")))
+    if isinstance(diarization_result, Annotation): return _normalize_annotation(diarization_result)
+    return _normalize_dataframe(diarization_result)
 
+def _normalize_annotation(annotation: Annotation) -> SpeakerTurns:
+    """collects the bounds and label of every track in a pyannote annotation"""
+    starts: list[float] = []
+    ends: list[float] = []
+    labels: list[str] = []
+    append_start, append_end, append_label = starts.append, ends.append, labels.append
+    for turn, _, label in annotation.itertracks(yield_label=True):
+        append_start(turn.start)
+        append_end(turn.end)
+        append_label(label)
+    return _speaker_turns(array(starts, dtype=float64), array(ends, dtype=float64), array(labels, dtype=object))
 
-    for segment in alignment_result.segments:
+def _normalize_dataframe(diarization_result: DataFrame) -> SpeakerTurns:
+    """reads the start, end and speaker (or label) columns of a whisperx diarization dataframe"""
+    label_column: str = "speaker" if "speaker" in diarization_result else "label"
+    if "start" not in diarization_result or "end" not in diarization_result or label_column not in diarization_result:
+        return _speaker_turns(zeros(0, dtype=float64), zeros(0, dtype=float64), zeros(0, dtype=object))
+    return _speaker_turns(diarization_result["start"].to_numpy(dtype=float64),
+                          diarization_result["end"].to_numpy(dtype=float64),
+                          diarization_result[label_column].to_numpy(dtype=object))
+
+def _speaker_turns(starts: ndarray, ends: ndarray, labels: ndarray) -> SpeakerTurns:
+    """drops turns without a label, with non-finite bounds or with no duration, and sorts the rest by (start, end)"""
+    starts = maximum(starts, 0.0)
+    # labels are stringified once, for the empty check and for factorize
+    label_text: ndarray = labels.astype(str)
+    keep: ndarray = isfinite(starts) & isfinite(ends) & (ends > starts) & notna(labels) & (label_text != "")
+    starts, ends, label_text = starts[keep], ends[keep], label_text[keep]
+    order: ndarray = lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    # ids follow sorted label order, so argmax breaks overlap ties towards the label that sorts first
+    label_ids, label_table = factorize(label_text[order].astype(object), sort=True)
+    reach: ndarray = maximum.accumulate(ends) if ends.size else ends
+    return SpeakerTurns(starts=starts, ends=ends, reach=reach, label_ids=label_ids, labels=label_table,
+                        turn_labels=label_table[label_ids].tolist())
+
+def _assign_word_speakers(alignment_result: AlignmentResult, turns: SpeakerTurns) -> None:
+    """
+    gives every word the speaker that overlaps it the longest, the same rule as whisperx.assign_word_speakers
+    without the dict round trip and the per-word dataframe filtering; ties go to the label that sorts first, which is what
+    whisperx's groupby picks under a stable sort. words without any overlap keep their speaker,
+    or if they have none get the turn containing their start from _fill_missing_word_speakers
+    """
+    # word bounds are read once here and handed on as plain floats
+    pending: list[WordEntry] = []
+    pending_starts: list[float] = []
+    pending_ends: list[float] = []
+    segments: list[WordAlignedSegment] = alignment_result.segments
+    segment_starts: list[float] = [segment.duration.start for segment in segments]
+    segment_ends: list[float] = [segment.duration.end for segment in segments]
+    for segment, segment_start, segment_end, covering in zip(segments, segment_starts, segment_ends,
+                                                             _covering_speakers(segment_starts, segment_ends, turns)):
         for word_entry in segment.words:
-            if word_entry.speaker: continue
-            word_time = float(word_entry.duration.start)
-            for interval_start, interval_end, interval_label in diarization_intervals:
-                if interval_start <= word_time < interval_end and interval_label:
-                    word_entry.speaker = interval_label
-                    break
+            word_start, word_end = word_entry.duration.start, word_entry.duration.end
+            if covering and segment_start <= word_start < word_end <= segment_end: word_entry.speaker = covering
+            else:
+                pending.append(word_entry)
+                pending_starts.append(word_start)
+                pending_ends.append(word_end)
+    for word_entry, speaker in zip(pending, _majority_speakers(pending_starts, pending_ends, turns)):
+        if speaker: word_entry.speaker = speaker
+    # only words that went through the vote can still be unlabelled, so the fill doesn't walk every word again
+    _fill_missing_word_speakers([word_entry for word_entry in pending if not word_entry.speaker], turns)
+
+def _covering_speakers(interval_starts: list[float], interval_ends: list[float], turns: SpeakerTurns) -> list[str | None]:
+    """
+    for every interval, returns the label of the turn covering all of it when it overlaps no other turn, else None
+    common case: a single turn covers a whole segment, so every timed word inside it belongs to that turn
+    """
+    if not turns.starts.size: return [None] * len(interval_starts)
+    starts: ndarray = array(interval_starts, dtype=float64)
+    ends: ndarray = array(interval_ends, dtype=float64)
+    # all intervals at once: turns before first have ended by the start, turns from last on begin after the end
+    first: ndarray = searchsorted(turns.reach, starts, side="right")
+    last: ndarray = searchsorted(turns.starts, ends, side="left")
+    candidate: ndarray = minimum(first, turns.starts.size - 1)
+    covered: ndarray = (last - first == 1) & (turns.starts[candidate] <= starts) & (turns.ends[candidate] >= ends)
+    turn_labels: list[str] = turns.turn_labels
+    return [turn_labels[turn_index] if is_covered else None for turn_index, is_covered in zip(candidate.tolist(), covered.tolist())]
+
+def _fill_missing_word_speakers(missing: list[WordEntry], turns: SpeakerTurns) -> None:
+    """
+    fills the "speaker" field of words that have none using diarization turns
+    assigns the label of the earliest turn whose interval contains the word start time
+    """
+    if not missing or not turns.starts.size: return
+    word_times: list[float] = [word_entry.duration.start for word_entry in missing]
+    turn_indices: list[int] = _covering_turns(word_times, turns.starts.tolist(), turns.ends.tolist(), turns.reach.tolist())
+    turn_labels: list[str] = turns.turn_labels
+    for word_entry, turn_index in zip(missing, turn_indices):
+        if turn_index >= 0: word_entry.speaker = turn_labels[turn_index]
+
+def _covering_turns(word_times: list[float], starts: list[float], ends: list[float], reach: list[float]) -> list[int]:
+    """
+    returns, for every time, the index of the earliest turn containing it, or -1
+    words arrive in time order, so the window of candidate turns only ever moves forward;
+    plain lists keep the search free of per-element numpy scalar boxing
+    """
+    turn_indices: list[int] = []
+    first: int = 0
+    last: int = 0
+    previous_time: float = float("-inf")
+    for word_time in word_times:
+        # only turns in [first, last) can contain word_time: later ones start after it, earlier ones have all ended.
+        # the bisects resume from the previous window, so long stretches of labelled words are skipped in log time;
+        # a word out of order (e.g. one without timings) searches from the beginning again
+        if word_time < previous_time: first, last = 0, 0
+        first, last = bisect_right(reach, word_time, first), bisect_right(starts, word_time, last)
+        previous_time = word_time
+        turn_indices.append(next((turn_index for turn_index in range(first, last) if ends[turn_index] > word_time), -1))
+    return turn_indices
+
+def _majority_speakers(interval_starts: list[float], interval_ends: list[float], turns: SpeakerTurns) -> list[str | None]:
+    """
+    for every interval, returns the label that overlaps it for the longest total time (the first in sorted order on a tie), or None without any overlap
+    overlaps are computed as an (intervals x turns) matrix, in row chunks so it stays within _OVERLAP_CHUNK_CELLS,
+    and each chunk only looks at the turns that can reach into its time span
+    """
+    turn_count: int = turns.starts.size
+    if not turn_count: return [None] * len(interval_starts)
+    label_count: int = len(turns.labels)
+    starts: ndarray = array(interval_starts, dtype=float64)
+    ends: ndarray = array(interval_ends, dtype=float64)
+    labels: list[str] = turns.labels.tolist()
+    speakers: list[str | None] = []
+    rows_per_chunk: int = max(1, _OVERLAP_CHUNK_CELLS // turn_count)
+    for offset in range(0, starts.size, rows_per_chunk):
+        chunk_starts: ndarray = starts[offset:offset + rows_per_chunk, None]
+        chunk_ends: ndarray = ends[offset:offset + rows_per_chunk, None]
+        rows: int = chunk_starts.shape[0]
+        # turns before first have all ended by the earliest start, turns from last on begin after the latest end
+        first: int = int(searchsorted(turns.reach, chunk_starts.min(), side="right"))
+        last: int = max(first, int(searchsorted(turns.starts, chunk_ends.max(), side="left")))
+        overlaps: ndarray = (minimum(chunk_ends, turns.ends[first:last]) - maximum(chunk_starts, turns.starts[first:last])).clip(min=0.0)
+        # one bincount sums overlaps per (row, label) pair
+        keys: ndarray = arange(rows)[:, None] * label_count + turns.label_ids[first:last]
+        label_durations: ndarray = bincount(keys.ravel(), weights=overlaps.ravel(), minlength=rows * label_count).reshape(rows, label_count)
+        best: ndarray = label_durations.argmax(axis=1)
+        found: ndarray = label_durations[arange(rows), best] > 0.0
+        speakers.extend(labels[label_id] if has_overlap else None for label_id, has_overlap in zip(best.tolist(), found.tolist()))
+    return speakers
+
+def _join_words(words: list[WordEntry]) -> str:
+    """joins aligned words into one line of text with a single allocation"""
+    return " ".join([word.word for word in words])
 
 def _format_timestamp(total_seconds: float) -> str:
     """formats a number of seconds into HH:MM:SS"""
-    hours: int = int(total_seconds // 3600)
-    minutes: int = int((total_seconds % 3600) // 60)
-    seconds: int = int(total_seconds % 60)
-
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    minutes, seconds = divmod(int(total_seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d" % (hours, minutes, seconds)